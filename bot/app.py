@@ -1,14 +1,28 @@
 import os
+import re
+import tempfile
+import threading
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import gradio as gr
 import sys
 
+try:
+    import ahocorasick
+except ImportError:
+    # Optional: intent matching falls back to compiled regex alternations
+    ahocorasick = None
+
 # Add the parent directory to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # Import analysis functions
 from scripts.analyzes import (
+    USED_COLS,
+    used_columns,
     clean_and_process_kpi,
+    compute_all_shop_stats,
     analyze_highest_revenue,
     analyze_lowest_baytime,
     analyze_highest_cpd,
@@ -22,112 +36,286 @@ DATA_DIR = os.path.join(PROJECT_ROOT, 'data')
 DATA_FILENAME = "KPI_Report.xlsx"
 
 # --- Load Data ---
-def load_data(filename=DATA_FILENAME):
+# Parquet metadata key holding the st_mtime_ns of the Excel file it was built from
+PARQUET_SOURCE_MTIME_KEY = b'source_mtime_ns'
+
+def _fresh_parquet_schema(parquet_path, source_mtime):
+    # The Parquet copy's schema if it was built from this exact source, else None
+    try:
+        schema = pq.read_schema(parquet_path)
+    except (OSError, pa.ArrowException):
+        return None
+    if (schema.metadata or {}).get(PARQUET_SOURCE_MTIME_KEY) != source_mtime:
+        return None
+    return schema
+
+def read_excel_via_parquet(data_path, mtime):
+    """
+    Read an Excel file through a Parquet copy kept next to it, rebuilding the copy
+    whenever the source mtime differs from the one it was built from.
+    """
+    parquet_path = os.path.splitext(data_path)[0] + '.parquet'
+    source_mtime = str(mtime).encode()
+    schema = _fresh_parquet_schema(parquet_path, source_mtime)
+    if schema is not None:
+        return pd.read_parquet(
+            parquet_path, engine='pyarrow', columns=used_columns(schema.names), dtype_backend='pyarrow'
+        )
+
+    df = pd.read_excel(data_path, usecols=lambda col: col in USED_COLS)
+    # Mixed number/text columns (e.g. '-' placeholders) can't be stored as Arrow objects
+    for col in df.select_dtypes(include='object').columns:
+        df[col] = df[col].astype('string')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        PARQUET_SOURCE_MTIME_KEY: source_mtime,
+    })
+
+    # Write to a temp file and rename so readers never see a partial copy; if the
+    # directory isn't writable, serve the Excel data without caching it
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp.parquet', dir=os.path.dirname(parquet_path))
+        os.close(fd)
+        pq.write_table(table, tmp_path, compression='snappy')
+        os.replace(tmp_path, parquet_path)
+    except (OSError, pa.ArrowException) as e:
+        print(f"Could not write Parquet copy, reading Excel directly: {e}")
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    # Same column order and dtypes as the read_parquet path above
+    return table.select(used_columns(table.schema.names)).to_pandas(types_mapper=pd.ArrowDtype)
+
+def _read_data(data_path, mtime):
+    if data_path.lower().endswith('.csv'):
+        # The pyarrow engine can't take a callable usecols, so intersect with the header
+        header = pd.read_csv(data_path, nrows=0).columns
+        return pd.read_csv(
+            data_path, usecols=used_columns(header), engine='pyarrow', dtype_backend='pyarrow'
+        )
+    elif data_path.lower().endswith(('.xlsx', '.xls')):
+        return read_excel_via_parquet(data_path, mtime)
+    else:
+        raise ValueError("Unsupported file type")
+
+def load_data(filename, mtime):
     data_path = os.path.join(DATA_DIR, filename)
     try:
-        if filename.lower().endswith('.csv'):
-            return pd.read_csv(data_path)
-        elif filename.lower().endswith(('.xlsx', '.xls')):
-            return pd.read_excel(data_path)
-        else:
-            raise ValueError("Unsupported file type")
+        return _read_data(data_path, mtime)
     except Exception as e:
         print(f"Error loading data: {e}")
         return None
 
-# --- Respond Function ---
-def respond(user_message, chat_history=None):
-    user_message_clean = user_message.lower().strip().strip('"').strip("'")
-    df = load_data()
+def _build_kpi(df):
+    df = clean_and_process_kpi(df)
+    stats = compute_all_shop_stats(df)
+    kpi = {
+        'df': df,
+        'stats': stats,
+        'highest_revenue': analyze_highest_revenue(df, stats),
+        'lowest_baytime': analyze_lowest_baytime(df, stats),
+        'highest_cpd': analyze_highest_cpd(df, stats),
+        'highest_growth': analyze_highest_growth(df, stats),
+    }
+    # Replies that only depend on the file are formatted once per load
+    # Arrow-backed columns format each value on its own; numpy dtypes give the
+    # aligned fixed-precision columns
+    head = df.head()
+    head = head.astype({col: dtype.numpy_dtype for col, dtype in head.dtypes.items()
+                        if isinstance(dtype, pd.ArrowDtype)})
+    kpi['head_str'] = head.to_string(index=False)
+    kpi['leaderboard_str'] = build_leaderboard(
+        kpi['highest_revenue'],
+        kpi['lowest_baytime'],
+        kpi['highest_cpd'],
+        kpi['highest_growth']
+    ).head().to_string()
+    return kpi
+
+def load_kpi(filename, mtime):
+    """
+    Return the cleaned KPI frame and its per-shop analyses for the file as of mtime.
+    """
+    df = load_data(filename, mtime)
+    if df is None:
+        return None
+    return _build_kpi(df)
 
-    # Phrase buckets
-    show_rows_phrases = [
+# --- App State ---
+# The KPI data being served and the data file mtime it was loaded at. The file
+# is only read and cleaned again when its exact mtime changes (a replacement
+# with an older mtime counts too), and a reload that fails keeps the last good
+# data in place.
+STATE = {'kpi': None, 'mtime': None}
+# Gradio answers up to eight messages at once on worker threads; one of them
+# reloads a changed file while the rest wait
+_STATE_LOCK = threading.Lock()
+
+def get_kpi(filename=DATA_FILENAME):
+    """
+    Return the served KPI data, reloading it once per change of the data file.
+    """
+    data_path = os.path.join(DATA_DIR, filename)
+    try:
+        mtime = os.stat(data_path).st_mtime_ns
+    except OSError as e:
+        print(f"Error loading data: {e}")
+        return STATE['kpi']
+    if mtime != STATE['mtime']:
+        with _STATE_LOCK:
+            if mtime != STATE['mtime']:
+                kpi = load_kpi(filename, mtime)
+                if kpi is not None:
+                    STATE['kpi'] = kpi
+                STATE['mtime'] = mtime
+    return STATE['kpi']
+
+# --- Intents ---
+INTENT_SHOW_ROWS = 'show_rows'
+INTENT_REVENUE = 'revenue'
+INTENT_BAYTIME = 'baytime'
+INTENT_CPD = 'cpd'
+INTENT_GROWTH = 'growth'
+INTENT_LEADERBOARD = 'leaderboard'
+
+# Whitespace and quote characters trimmed from incoming messages
+MESSAGE_STRIP_CHARS = ' \t\n\r"\''
+
+# Phrase buckets, in priority order: when a message matches several buckets
+# the earliest one wins
+INTENT_PHRASES = {
+    INTENT_SHOW_ROWS: frozenset({
         "show me the first 5 rows", "show first 5 rows", "display first 5 rows",
         "show top 5 rows", "show first five rows", "show me top 5 rows",
         "show five rows", "five rows", "5 rows"
-    ]
-
-    revenue_phrases = [
+    }),
+    INTENT_REVENUE: frozenset({
         "highest average daily sales", "top sales", "most sales per day",
         "shop with highest sales", "best performing shop", "shop with best sales",
         "top revenue", "highest revenue", "revenue"
-    ]
-
-    baytime_phrases = [
+    }),
+    INTENT_BAYTIME: frozenset({
         "lowest bay time", "least bay time", "bay time minimum", "minimum bay time",
         "shop with lowest bay time", "fastest bay time", "quickest bay time",
         "best bay time", "top bay time", "baytime", "bay time"
-    ]
-
-    growth_phrases = [
-        "highest growth", "yearly sales growth", "sales growth",
-        "growth rate", "best growth", "top growth", "most growth", "growth"
-    ]
-
-    cpd_phrases = [
+    }),
+    INTENT_CPD: frozenset({
         "highest cpd", "count per day", "cars per day", "car count", "top cpd",
         "most cars", "most car", "most cpd", "highest cars", "cpd"
-    ]
-
-    leaderboard_phrases = [
+    }),
+    INTENT_GROWTH: frozenset({
+        "highest growth", "yearly sales growth", "sales growth",
+        "growth rate", "best growth", "top growth", "most growth", "growth"
+    }),
+    INTENT_LEADERBOARD: frozenset({
         "leaderboard", "top shops", "top performers", "best shops",
         "shop rankings", "shop leaderboard", "show rankings",
         "top 5 shops", "top ranked shops"
-    ]
+    }),
+}
+INTENT_PRIORITY = list(INTENT_PHRASES)
 
-    if df is None:
-        return "❌ Failed to load data."
+def _build_automaton():
+    # One Aho-Corasick automaton over every phrase, valued by bucket priority
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for priority, intent in enumerate(INTENT_PRIORITY):
+        for phrase in INTENT_PHRASES[intent]:
+            automaton.add_word(phrase, priority)
+    automaton.make_automaton()
+    return automaton
 
-    df = clean_and_process_kpi(df)
+INTENT_AUTOMATON = _build_automaton()
 
-    # Phrase matching logic
-    if any(phrase in user_message_clean for phrase in show_rows_phrases):
-        return f"Here are the first 5 rows:\n{df.head().to_string(index=False)}"
-
-    elif any(phrase in user_message_clean for phrase in revenue_phrases):
-        highest_revenue = analyze_highest_revenue(df)
-        top_row = highest_revenue.iloc[0]
-        return f"The shop with the highest average daily sales is **{top_row['Shop']}** with an average of **${top_row['Highest Sales']:,.2f}** per day."
-
-    elif any(phrase in user_message_clean for phrase in baytime_phrases):
-        lowest_baytime = analyze_lowest_baytime(df)
-        if not lowest_baytime.empty:
-            top_row = lowest_baytime.iloc[0]
-            return f"The shop with the lowest average bay time is **{top_row['Shop']}** with **{top_row['Lowest BayTime']} minutes**."
-        else:
-            return "BayTime data is not available."
-
-    elif any(phrase in user_message_clean for phrase in cpd_phrases):
-        highest_cpd = analyze_highest_cpd(df)
-        if not highest_cpd.empty:
-            top_row = highest_cpd.iloc[0]
-            return f"**{top_row['Shop']}** has the highest average CPD at **{top_row['Highest Number of CPD']}**."
-        else:
-            return "CPD data is not available."
-
-    elif any(phrase in user_message_clean for phrase in growth_phrases):
-        highest_growth = analyze_highest_growth(df)
-        if not highest_growth.empty:
-            top_row = highest_growth.iloc[0]
-            return f"**{top_row['Shop']}** has the highest yearly sales growth at **{top_row['Growth.Label']}**."
-        else:
-            return "Sales growth data is not available."
-
-    elif any(phrase in user_message_clean for phrase in leaderboard_phrases):
-        leaderboard = build_leaderboard(
-            analyze_highest_revenue(df),
-            analyze_lowest_baytime(df),
-            analyze_highest_cpd(df),
-            analyze_highest_growth(df)
-        )
-        top5 = leaderboard.head().to_string()
-        return f"🏆 Top shops leaderboard:\n{top5}"
+# One compiled alternation per bucket, used when pyahocorasick isn't installed
+INTENT_PATTERNS = {
+    intent: re.compile("|".join(map(re.escape, sorted(phrases))))
+    for intent, phrases in INTENT_PHRASES.items()
+}
+
+def match_intent(message):
+    """
+    Return the highest-priority intent whose phrases occur in the message, or None.
+    """
+    if INTENT_AUTOMATON is None:
+        for intent in INTENT_PRIORITY:
+            if INTENT_PATTERNS[intent].search(message):
+                return intent
+        return None
+
+    priorities = [priority for _, priority in INTENT_AUTOMATON.iter(message)]
+    if not priorities:
+        return None
+    return INTENT_PRIORITY[min(priorities)]
+
+# --- Intent Handlers ---
+def handle_show_rows(kpi):
+    return f"Here are the first 5 rows:\n{kpi['head_str']}"
+
+def handle_revenue(kpi):
+    highest_revenue = kpi['highest_revenue']
+    top_row = highest_revenue.iloc[0]
+    return f"The shop with the highest average daily sales is **{top_row['Shop']}** with an average of **${top_row['Highest Sales']:,.2f}** per day."
+
+def handle_baytime(kpi):
+    lowest_baytime = kpi['lowest_baytime']
+    if not lowest_baytime.empty:
+        top_row = lowest_baytime.iloc[0]
+        return f"The shop with the lowest average bay time is **{top_row['Shop']}** with **{top_row['Lowest BayTime']} minutes**."
+    else:
+        return "BayTime data is not available."
+
+def handle_cpd(kpi):
+    highest_cpd = kpi['highest_cpd']
+    if not highest_cpd.empty:
+        top_row = highest_cpd.iloc[0]
+        return f"**{top_row['Shop']}** has the highest average CPD at **{top_row['Highest Number of CPD']}**."
+    else:
+        return "CPD data is not available."
+
+def handle_growth(kpi):
+    highest_growth = kpi['highest_growth']
+    if not highest_growth.empty:
+        top_row = highest_growth.iloc[0]
+        return f"**{top_row['Shop']}** has the highest yearly sales growth at **{top_row['Growth.Label']}**."
+    else:
+        return "Sales growth data is not available."
+
+def handle_leaderboard(kpi):
+    return f"🏆 Top shops leaderboard:\n{kpi['leaderboard_str']}"
+
+INTENT_HANDLERS = {
+    INTENT_SHOW_ROWS: handle_show_rows,
+    INTENT_REVENUE: handle_revenue,
+    INTENT_BAYTIME: handle_baytime,
+    INTENT_CPD: handle_cpd,
+    INTENT_GROWTH: handle_growth,
+    INTENT_LEADERBOARD: handle_leaderboard,
+}
+
+# --- Respond Function ---
+FALLBACK_STR = (
+    "🤔 Sorry, I didn't catch a KPI question there.\n"
+    "Try asking about: 'highest average daily sales', 'lowest bay time', 'leaderboard', etc."
+)
+
+def respond(user_message, chat_history=None):
+    user_message_clean = user_message.strip(MESSAGE_STRIP_CHARS).lower()
+
+    # Phrase matching logic; messages with no intent never touch the data
+    intent = match_intent(user_message_clean)
+    if intent is None:
+        return FALLBACK_STR
+
+    kpi = get_kpi()
+    if kpi is None:
+        return "❌ Failed to load data."
 
-    # Default fallback
-    return (
-        f"✅ Data loaded with {len(df)} rows and {len(df.columns)} columns.\n"
-        "Try asking about: 'highest average daily sales', 'lowest bay time', 'leaderboard', etc."
-    )
+    return INTENT_HANDLERS[intent](kpi)
 
 # --- Launch Gradio App ---
-gr.ChatInterface(fn=respond).launch()
+# Load and clean the data once before serving so the first message is warm
+get_kpi()
+gr.ChatInterface(fn=respond).queue(default_concurrency_limit=8).launch()
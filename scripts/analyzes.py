@@ -1,106 +1,194 @@
+import numpy as np
 import pandas as pd
 import os
 
+try:
+    from numba import njit, prange
+except ImportError:
+    # Optional: per-shop means fall back to pandas groupby
+    njit = None
+    prange = range
+
+# Columns the cleaning and analysis steps actually use; everything else is
+# skipped at read time
+USED_COLS = [
+    'Shop', 'Sales / Day', 'BayTime', 'CPD', 'Net Sales - YoY %',
+    'WeekEndingCY', 'CPD - PY', 'Customers Repeat % - CY'
+]
+
+def used_columns(names):
+    """
+    Return the USED_COLS present in names; metric columns like BayTime are optional.
+    """
+    return [col for col in USED_COLS if col in names]
+
 def load_data(filename="KPI_Report.csv"):
     """
     Load KPI data from CSV file.
     """
     data_path = os.path.join(os.path.dirname(__file__), '..', 'data', filename)
-    return pd.read_csv(data_path)
+    return pd.read_csv(data_path, usecols=lambda col: col in USED_COLS)
+
+def to_numeric_stripped(series, pattern):
+    """
+    Convert a column to numbers, regex-stripping only the cells that don't parse as-is.
+    """
+    # float64 keeps NaN and NA unified (Arrow-backed input can yield non-null NaN)
+    # and leaves room for decimals when the parsed cells were all integers
+    numeric = pd.to_numeric(series, errors='coerce').astype('float64')
+    needs_strip = numeric.isna() & series.notna()
+    if needs_strip.any():
+        stripped = pd.to_numeric(
+            series[needs_strip].astype(str).str.replace(pattern, '', regex=True),
+            errors='coerce'
+        )
+        numeric = numeric.mask(needs_strip, stripped)
+    return numeric
 
 def clean_and_process_kpi(df):
     """
     Clean and preprocess the KPI dataframe.
     """
-    # Convert date column
-    df['WeekEndingCY'] = pd.to_datetime(df['WeekEndingCY'], errors='coerce')
-
-    # Filter invalid Sales / Day
-    df = df[df['Sales / Day'].notna()]
-    df = df[df['Sales / Day'] != 0]
-    df = df[df['Sales / Day'] != '']
+    # Filter invalid Sales / Day, CPD - PY and Customers Repeat % - CY in one pass.
+    # Missing CPD - PY / repeat values are kept: on Arrow-backed columns != 0
+    # yields <NA> for them, which .loc would treat as False
+    sales = df['Sales / Day']
+    mask = (
+        sales.notna() & sales.ne(0).fillna(True) & sales.ne('').fillna(True)
+        & df['CPD - PY'].ne(0).fillna(True)
+        & df['Customers Repeat % - CY'].ne(0).fillna(True)
+    )
+    df = df.loc[mask].copy()
 
-    # Clean Sales / Day column
-    df['Sales / Day'] = df['Sales / Day'].astype(str).str.replace(r'[$,\s]', '', regex=True)
-    df['Sales / Day'] = pd.to_numeric(df['Sales / Day'], errors='coerce')
+    # Convert date column (the report exports week-ending dates as M/D/YYYY)
+    df['WeekEndingCY'] = pd.to_datetime(df['WeekEndingCY'], format='%m/%d/%Y', errors='coerce')
 
-    # Filter rows with valid CPD - PY and Customers Repeat % - CY
-    df = df[(df['CPD - PY'] != 0) & (df['CPD - PY'] != 0) & (df['Customers Repeat % - CY'] != 0)]
+    # Group on integer category codes instead of hashing each Shop value
+    df['Shop'] = df['Shop'].astype('category')
 
-    # Drop unwanted columns if they exist
-    columns_to_drop = [
-        'High.Mileage.Opportunity...CY', 'Emission.Tickets...CY',
-        'Emission.Gross.ARO...CY', 'Emissions.Penetration..',
-        'Emissions.with.Big.5.....CY'
-    ]
-    df = df.drop(columns=[col for col in columns_to_drop if col in df.columns], errors='ignore')
+    # Clean Sales / Day column
+    df['Sales / Day'] = to_numeric_stripped(df['Sales / Day'], r'[$,\s]')
 
     # Clean Net Sales - YoY % column if exists
     if 'Net Sales - YoY %' in df.columns:
-        df['Net Sales - YoY %'] = df['Net Sales - YoY %'].astype(str).str.replace(r'[\s,%]', '', regex=True)
-        df['Net Sales - YoY %'] = pd.to_numeric(df['Net Sales - YoY %'], errors='coerce')
+        df['Net Sales - YoY %'] = to_numeric_stripped(df['Net Sales - YoY %'], r'[\s,%]')
 
     return df
 
-def analyze_highest_revenue(df):
+SHOP_STAT_COLUMNS = ['Sales / Day', 'BayTime', 'CPD', 'Net Sales - YoY %']
+
+# Number of ranked shops each analyzer keeps; the leaderboard reads up to Top5
+TOP_N = 5
+
+def _group_means(codes, values, n_groups):
+    """
+    Mean of each column of values per group code, skipping NaNs and negative codes.
+    """
+    n_rows, n_cols = values.shape
+    means = np.full((n_groups, n_cols), np.nan)
+    # Columns are independent, so each thread owns one and no sums are shared
+    for j in prange(n_cols):
+        sums = np.zeros(n_groups)
+        counts = np.zeros(n_groups)
+        for i in range(n_rows):
+            code = codes[i]
+            value = values[i, j]
+            if code >= 0 and not np.isnan(value):
+                sums[code] += value
+                counts[code] += 1
+        for g in range(n_groups):
+            if counts[g] > 0:
+                means[g, j] = sums[g] / counts[g]
+    return means
+
+if njit is not None:
+    _group_means = njit(parallel=True)(_group_means)
+
+def compute_all_shop_stats(df):
+    """
+    Calculate per-Shop means of every metric column, in one parallel pass over the
+    columns when Numba is available and a pandas groupby otherwise.
+    """
+    columns = [col for col in SHOP_STAT_COLUMNS if col in df.columns]
+    if njit is None or not columns or not isinstance(df['Shop'].dtype, pd.CategoricalDtype):
+        return df.groupby('Shop', sort=False, observed=True).agg({col: 'mean' for col in columns})
+
+    shops = df['Shop'].cat
+    codes = shops.codes.to_numpy()
+    values = np.column_stack([df[col].to_numpy(dtype='float64', na_value=np.nan) for col in columns])
+    means = _group_means(codes, values, len(shops.categories))
+
+    # Match groupby(observed=True): only shops that have rows, categories kept intact
+    observed = np.bincount(codes[codes >= 0], minlength=len(shops.categories)) > 0
+    index = pd.CategoricalIndex(
+        pd.Categorical.from_codes(np.flatnonzero(observed), dtype=df['Shop'].dtype),
+        name='Shop'
+    )
+    return pd.DataFrame(means[observed], index=index, columns=columns)
+
+def analyze_highest_revenue(df, stats=None):
     """
-    Calculate mean daily sales by Shop, descending order.
+    Calculate mean daily sales by Shop, top shops in descending order.
     """
+    if stats is None:
+        stats = compute_all_shop_stats(df)
     highest_revenue = (
-        df.groupby('Shop')['Sales / Day']
-        .mean()
+        stats['Sales / Day']
         .round(2)
         .reset_index()
         .rename(columns={'Sales / Day': 'Highest Sales'})
-        .sort_values(by='Highest Sales', ascending=False)
+        .nlargest(TOP_N, 'Highest Sales')
     )
     return highest_revenue
 
-def analyze_lowest_baytime(df):
+def analyze_lowest_baytime(df, stats=None):
     """
-    Calculate mean BayTime by Shop, ascending order.
+    Calculate mean BayTime by Shop, top shops in ascending order.
     """
     if 'BayTime' not in df.columns:
         return pd.DataFrame()
+    if stats is None:
+        stats = compute_all_shop_stats(df)
     lowest_baytime = (
-        df.groupby('Shop')['BayTime']
-        .mean()
+        stats['BayTime']
         .round(2)
         .reset_index()
         .rename(columns={'BayTime': 'Lowest BayTime'})
-        .sort_values(by='Lowest BayTime')
+        .nsmallest(TOP_N, 'Lowest BayTime')
     )
     return lowest_baytime
 
-def analyze_highest_cpd(df):
+def analyze_highest_cpd(df, stats=None):
     """
-    Calculate mean CPD by Shop, descending order.
+    Calculate mean CPD by Shop, top shops in descending order.
     """
     if 'CPD' not in df.columns:
         return pd.DataFrame()
+    if stats is None:
+        stats = compute_all_shop_stats(df)
     highest_cpd = (
-        df.groupby('Shop')['CPD']
-        .mean()
+        stats['CPD']
         .round(2)
         .reset_index()
         .rename(columns={'CPD': 'Highest Number of CPD'})
-        .sort_values(by='Highest Number of CPD', ascending=False)
+        .nlargest(TOP_N, 'Highest Number of CPD')
     )
     return highest_cpd
 
-def analyze_highest_growth(df):
+def analyze_highest_growth(df, stats=None):
     """
-    Calculate mean Net Sales YoY % by Shop, descending order.
+    Calculate mean Net Sales YoY % by Shop, top shops in descending order.
     """
     if 'Net Sales - YoY %' not in df.columns:
         return pd.DataFrame()
+    if stats is None:
+        stats = compute_all_shop_stats(df)
     highest_growth = (
-        df.groupby('Shop')['Net Sales - YoY %']
-        .mean()
+        stats['Net Sales - YoY %']
         .round(2)
         .reset_index()
         .rename(columns={'Net Sales - YoY %': 'Highest Yearly Sales Growth'})
-        .sort_values(by='Highest Yearly Sales Growth', ascending=False)
+        .nlargest(TOP_N, 'Highest Yearly Sales Growth')
     )
     highest_growth['Growth.Label'] = highest_growth['Highest Yearly Sales Growth'].astype(str) + '%'
     return highest_growth[['Shop', 'Growth.Label']]
@@ -109,39 +197,32 @@ def count_top(df_metric, top_n):
     """
     Helper to get top N shops from a metric dataframe.
     """
-    return df_metric.head(top_n).reset_index()[['Shop']].assign(Appearance=1)
+    return df_metric['Shop'].head(top_n)
 
 def build_leaderboard(highest_revenue, lowest_baytime, highest_cpd, highest_growth):
     """
     Build combined leaderboard DataFrame from different metrics.
     """
-    top_1 = pd.concat([
-        count_top(highest_revenue, 1),
-        count_top(lowest_baytime, 1),
-        count_top(highest_cpd, 1),
-        count_top(highest_growth, 1)
-    ])
-
-    top_3 = pd.concat([
-        count_top(highest_revenue, 3),
-        count_top(lowest_baytime, 3),
-        count_top(highest_cpd, 3),
-        count_top(highest_growth, 3)
-    ])
-
-    top_5 = pd.concat([
-        count_top(highest_revenue, 5),
-        count_top(lowest_baytime, 5),
-        count_top(highest_cpd, 5),
-        count_top(highest_growth, 5)
+    metrics = [highest_revenue, lowest_baytime, highest_cpd, highest_growth]
+    tops = [count_top(metric, 5) for metric in metrics if not metric.empty]
+    if not tops:
+        return pd.DataFrame(columns=['Top1', 'Top3', 'Top5'], dtype=int).rename_axis('Shop')
+
+    # Integer codes for every shop that made a Top5, whatever the Shop dtype;
+    # Top1 and Top3 are the leading rows of each metric's Top5
+    ranks = np.concatenate([np.arange(len(top)) for top in tops])
+    codes, shops = pd.factorize(pd.concat(tops, ignore_index=True), sort=True)
+    counts = np.column_stack([
+        np.bincount(codes[ranks < top_n], minlength=len(shops))
+        for top_n in (1, 3, 5)
     ])
 
-    leaderboard = (
-        top_1.groupby('Shop').sum().rename(columns={'Appearance': 'Top1'})
-        .join(top_3.groupby('Shop').sum().rename(columns={'Appearance': 'Top3'}), how='outer')
-        .join(top_5.groupby('Shop').sum().rename(columns={'Appearance': 'Top5'}), how='outer')
-        .fillna(0).astype(int)
-        .sort_values(by=['Top1', 'Top3', 'Top5'], ascending=[False, False, False])
+    # Rank by Top1, Top3, Top5 descending
+    order = np.lexsort((-counts[:, 2], -counts[:, 1], -counts[:, 0]))
+    leaderboard = pd.DataFrame(
+        counts[order],
+        index=pd.Index(np.asarray(shops)[order], name='Shop'),
+        columns=['Top1', 'Top3', 'Top5']
     )
     return leaderboard
 
@@ -149,11 +230,12 @@ def build_leaderboard(highest_revenue, lowest_baytime, highest_cpd, highest_grow
 if __name__ == "__main__":
     df = load_data()
     df = clean_and_process_kpi(df)
+    stats = compute_all_shop_stats(df)
 
-    highest_revenue = analyze_highest_revenue(df)
-    lowest_baytime = analyze_lowest_baytime(df)
-    highest_cpd = analyze_highest_cpd(df)
-    highest_growth = analyze_highest_growth(df)
+    highest_revenue = analyze_highest_revenue(df, stats)
+    lowest_baytime = analyze_lowest_baytime(df, stats)
+    highest_cpd = analyze_highest_cpd(df, stats)
+    highest_growth = analyze_highest_growth(df, stats)
 
     print("Highest Revenue:")
     print(highest_revenue.head())